@@ -3,31 +3,180 @@
 
 # DeepSpeed Team
 
-import os
-import pkgutil
+import contextlib
+import functools
 import importlib
+import threading
+from collections import defaultdict
 
 from .abstract_accelerator import DeepSpeedAccelerator
-# During setup stage torch may not be installed, pass on no torch will
-# allow op builder related API to be executed.
-import torch_musa
 
 
+class _UnavailableModule:
+    # stands in for torch/torch_musa when they cannot be imported, so that device and memory
+    # APIs fail with the original import error instead of a 'NoneType' attribute error
+    def __init__(self, name, error):
+        self._name = name
+        self._error = error
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        raise ImportError(f"MUSA accelerator requires {self._name}, which could not be imported: {self._error}")
+
+
+# torch and torch_musa are imported lazily on first accelerator construction, so
+# merely importing this module (e.g. during accelerator discovery) does not load
+# the MUSA runtime.
+torch = None
+torch_musa = None
+_torch_musa_import_attempted = False
+_torch_musa_import_lock = threading.RLock()
+
+
+def _lazy_import_torch_musa():
+    global torch, torch_musa, _torch_musa_import_attempted
+    if _torch_musa_import_attempted:
+        return torch_musa
+    with _torch_musa_import_lock:
+        if not _torch_musa_import_attempted:
+            # During setup stage torch may not be installed, pass on no torch will
+            # allow op builder related API to be executed.
+            try:
+                import torch as _torch
+                torch = _torch
+            except ImportError as e:
+                torch = _UnavailableModule('torch', e)
+            try:
+                import torch_musa as _torch_musa
+                torch_musa = _torch_musa
+                _bind_torch_musa()
+            except ImportError as e:
+                torch_musa = _UnavailableModule('torch_musa', e)
+            # only mark the import as done once torch_musa is bound, other threads wait on the lock until then
+            _torch_musa_import_attempted = True
+    return torch_musa
+
+
+@functools.lru_cache(maxsize=None)
+def _device_name(device_index):
+    if device_index is None:
+        return 'musa'
+    return 'musa:{}'.format(device_index)
+
+
+@functools.lru_cache(maxsize=None)
+def _fp16_supported(device_index):
+    major, _ = torch_musa.get_device_capability(device_index)
+    if major >= 7:
+        return True
+    else:
+        return False
+
+
+# snapshot of torch_musa.default_generators, it is empty until torch_musa is lazily initialized
+# so the snapshot is refreshed whenever an index is not covered yet
+_default_generators = ()
+
+
+def _default_generator(device_index):
+    global _default_generators
+    try:
+        return _default_generators[device_index]
+    except IndexError:
+        _default_generators = tuple(torch_musa.default_generators)
+        return _default_generators[device_index]
+
+
+# pinned host buffers are shared by all accelerator instances, since get_accelerator() constructs a new one per call.
+# _pinned_buffers records the storages allocated by pin_memory() (data_ptr <--> StorageWeakRef) so that
+# release_pinned() only takes back memory the pool owns, _pinned_pool holds (dtype, numel) <--> list of
+# (buffer, event) released for reuse, a buffer is handed out again only once its event has completed
+_PINNED_POOL_MAX_BUFFERS = 16  # released buffers kept per (dtype, numel), further ones are freed
+_pinned_lock = threading.Lock()
+_pinned_buffers = {}
+_pinned_pool = defaultdict(list)
+
+
+def _record_buffer(records, buffer):
+    from torch.multiprocessing.reductions import StorageWeakRef
+    # drop records of freed storages, their addresses may be reused by other allocations
+    for data_ptr in [data_ptr for data_ptr, ref in records.items() if ref.expired()]:
+        del records[data_ptr]
+    records[buffer.data_ptr()] = StorageWeakRef(buffer.untyped_storage())
+
+
+def _whole_recorded_buffer(records, tensor):
+    # return a flat view of the whole buffer if tensor spans the entire storage of a buffer in records, else None.
+    # ownership is keyed on the storage, views do not need to keep the original buffer tensor alive
+    from torch.multiprocessing.reductions import StorageWeakRef
+    ref = records.get(tensor.data_ptr())
+    if ref is None or ref.expired() or tensor.storage_offset() != 0:
+        return None
+    storage = tensor.untyped_storage()
+    if ref.cdata != StorageWeakRef(storage).cdata or tensor.numel() * tensor.element_size() != storage.nbytes():
+        return None
+    return tensor.as_strided((tensor.numel(), ), (1, ))
+
+
+# device workspace buffers are shared by all accelerator instances as well, _workspace_buffers records the
+# storages allocated by alloc_workspace() (data_ptr <--> StorageWeakRef) so that free_workspace() only takes back
+# memory the cache owns, _workspace holds (device index, rounded nbytes, dtype) <--> list of buffers for reuse
+_WORKSPACE_MAX_BUFFERS = 16  # released buffers kept per key, further ones are freed
+_workspace_lock = threading.Lock()
+_workspace_buffers = {}
+_workspace = defaultdict(list)
+
+
+# device memory size is fixed for the lifetime of the process, query it once per device
+@functools.lru_cache(maxsize=None)
+def _total_memory(device_index):
+    return torch_musa.get_device_properties(device_index).total_memory
+
+
+# import outcomes do not change during a run, so probe for the op_builder location only once
+@functools.lru_cache(maxsize=1)
+def _resolve_op_builder_dir():
+    try:
+        # is op_builder from deepspeed or a 3p version? this should only succeed if it's deepspeed
+        # if successful this also means we're doing a local install and not JIT compile path
+        from op_builder import __deepspeed__  # noqa: F401
+        return "op_builder"
+    except ImportError:
+        return "deepspeed.ops.op_builder"
+
 
 class MUSA_Accelerator(DeepSpeedAccelerator):
 
+    # methods that forward their arguments to the torch_musa function of the same name unchanged,
+    # with the same parameters and defaults (device() is excluded, torch_musa.device has no default)
+    _PASSTHROUGH_APIS = ('set_device', 'current_device', 'device_count', 'synchronize', 'manual_seed',
+                         'manual_seed_all', 'stream', 'current_stream', 'default_stream', 'empty_cache',
+                         'memory_allocated', 'max_memory_allocated', 'reset_max_memory_allocated', 'memory_cached',
+                         'max_memory_cached', 'reset_max_memory_cached', 'is_bf16_supported', 'is_available')
+
+    # optional torch_musa APIs, resolved once by _bind_torch_musa() instead of probing them on every call
+    _memory_stats = None
+    _reset_peak_memory_stats = None
+    _memory_reserved = None
+    _max_memory_reserved = None
+    _amp = None
+    _range_push = None
+    _range_pop = None
+    _mem_pool = None
+    _use_mem_pool = None
+
     def __init__(self):
         self._name = 'musa'
         self._communication_backend_name = 'mccl'
+        _lazy_import_torch_musa()
 
     def is_synchronized_device(self):
         return False
 
     # Device APIs
     def device_name(self, device_index=None):
-        if device_index == None:
-            return 'musa'
-        return 'musa:{}'.format(device_index)
+        return _device_name(device_index)
 
     def device(self, device_index=None):
         return torch_musa.device(device_index)
@@ -39,7 +188,7 @@ class MUSA_Accelerator(DeepSpeedAccelerator):
         return torch_musa.current_device()
 
     def current_device_name(self):
-        return 'musa:{}'.format(torch_musa.current_device())
+        return _device_name(torch_musa.current_device())
 
     def device_count(self):
         return torch_musa.device_count()
@@ -73,7 +222,7 @@ class MUSA_Accelerator(DeepSpeedAccelerator):
         return torch_musa.initial_seed(seed)
 
     def default_generator(self, device_index):
-        return torch_musa.default_generators[device_index]
+        return _default_generator(device_index)
 
     # Streams/Events
     @property
@@ -116,51 +265,93 @@ class MUSA_Accelerator(DeepSpeedAccelerator):
         return torch_musa.reset_max_memory_cached(device_index)
 
     def memory_stats(self, device_index=None):
-        if hasattr(torch_musa, 'memory_stats'):
-            return torch_musa.memory_stats(device_index)
+        if self._memory_stats is not None:
+            return self._memory_stats(device_index)
 
     def reset_peak_memory_stats(self, device_index=None):
-        if hasattr(torch_musa, 'reset_peak_memory_stats'):
-            return torch_musa.reset_peak_memory_stats(device_index)
+        if self._reset_peak_memory_stats is not None:
+            return self._reset_peak_memory_stats(device_index)
 
     def memory_reserved(self, device_index=None):
-        if hasattr(torch_musa, 'memory_reserved'):
-            return torch_musa.memory_reserved(device_index)
+        if self._memory_reserved is not None:
+            return self._memory_reserved(device_index)
 
     def max_memory_reserved(self, device_index=None):
-        if hasattr(torch_musa, 'max_memory_reserved'):
-            return torch_musa.max_memory_reserved(device_index)
+        if self._max_memory_reserved is not None:
+            return self._max_memory_reserved(device_index)
+
+    # create a private memory pool, optionally backed by a custom (e.g. stream-ordered async) allocator
+    def create_mem_pool(self, allocator=None):
+        if self._mem_pool is not None:
+            return self._mem_pool(allocator)
+
+    # context manager that routes allocations made inside it to pool,
+    # falls back to the default caching allocator when memory pools are not supported
+    def use_mem_pool(self, pool, device_index=None):
+        if self._use_mem_pool is not None and pool is not None:
+            return self._use_mem_pool(pool, device_index)
+        return contextlib.nullcontext()
+
+    # return a 1-D device tensor of dtype spanning at least nbytes on the current device,
+    # reusing a buffer from free_workspace() if possible
+    def alloc_workspace(self, nbytes, dtype):
+        # round up to the 512 byte granularity of the caching allocator so close sizes share a bucket
+        nbytes = (nbytes + 511) // 512 * 512
+        device_index = torch_musa.current_device()
+        with _workspace_lock:
+            buffers = _workspace.get((device_index, nbytes, dtype))
+            if buffers:
+                return buffers.pop()
+        workspace = torch.empty((nbytes, ), dtype=torch.uint8, device=self.device_name(device_index)).view(dtype)
+        with _workspace_lock:
+            _record_buffer(_workspace_buffers, workspace)
+        return workspace
+
+    # hand a tensor obtained from alloc_workspace() back for reuse, its memory is kept, not freed.
+    # Only whole workspace buffers are taken back, slices and tensors from elsewhere are left alone
+    def free_workspace(self, tensor):
+        with _workspace_lock:
+            workspace = _whole_recorded_buffer(_workspace_buffers, tensor)
+            if workspace is None:
+                return
+            buffers = _workspace[(workspace.device.index, workspace.numel() * workspace.element_size(),
+                                  workspace.dtype)]
+            if len(buffers) >= _WORKSPACE_MAX_BUFFERS:
+                return
+            if any(b.data_ptr() == workspace.data_ptr() for b in buffers):
+                return
+            buffers.append(workspace)
 
     def total_memory(self, device_index=None):
-        return torch_musa.get_device_properties(device_index).total_memory
+        # resolve the current device first, None must not be cached as a device of its own
+        if device_index is None:
+            device_index = torch_musa.current_device()
+        return _total_memory(device_index)
 
     # Data types
     def is_bf16_supported(self):
         return torch_musa.is_bf16_supported()
 
     def is_fp16_supported(self):
-        major, _ = torch_musa.get_device_capability()
-        if major >= 7:
-            return True
-        else:
-            return False
+        # device capability is fixed for the lifetime of the process, query it once per device
+        return _fp16_supported(torch_musa.current_device())
 
     # Misc
     def amp(self):
-        if hasattr(torch_musa, 'amp'):
-            return torch_musa.amp
-        return None
+        return self._amp
 
     def is_available(self):
+        if isinstance(torch_musa, _UnavailableModule):
+            return False
         return torch_musa.is_available()
 
     def range_push(self, msg):
-        if hasattr(torch_musa.nvtx, 'range_push'):
-            return torch_musa.nvtx.range_push(msg)
+        if self._range_push is not None:
+            return self._range_push(msg)
 
     def range_pop(self):
-        if hasattr(torch_musa.nvtx, 'range_pop'):
-            return torch_musa.nvtx.range_pop()
+        if self._range_pop is not None:
+            return self._range_pop()
 
     def lazy_call(self, callback):
         return torch_musa._lazy_call(callback)
@@ -170,95 +361,123 @@ class MUSA_Accelerator(DeepSpeedAccelerator):
 
     # Tensor operations
 
-    @property
-    def BFloat16Tensor(self):
-        return torch_musa.BFloat16Tensor
-
-    @property
-    def ByteTensor(self):
-        return torch_musa.ByteTensor
-
-    @property
-    def DoubleTensor(self):
-        return torch_musa.DoubleTensor
-
-    @property
-    def FloatTensor(self):
-        return torch_musa.FloatTensor
-
-    @property
-    def HalfTensor(self):
-        return torch_musa.HalfTensor
-
-    @property
-    def IntTensor(self):
-        return torch_musa.IntTensor
-
-    @property
-    def LongTensor(self):
-        return torch_musa.LongTensor
+    # tensor types are plain class attributes, bound to the torch_musa types once torch_musa is loaded
+    _TENSOR_TYPES = ('BFloat16Tensor', 'ByteTensor', 'DoubleTensor', 'FloatTensor', 'HalfTensor', 'IntTensor',
+                     'LongTensor')
+    BFloat16Tensor = None
+    ByteTensor = None
+    DoubleTensor = None
+    FloatTensor = None
+    HalfTensor = None
+    IntTensor = None
+    LongTensor = None
 
     def pin_memory(self, tensor):
-        return tensor.pin_memory()
+        if tensor.is_pinned():
+            return tensor
+        if tensor.numel() == 0:
+            return tensor.pin_memory()
+        # reuse a released pinned buffer of the same size if possible, pinning host memory is expensive
+        buffer = None
+        with _pinned_lock:
+            buffers = _pinned_pool.get((tensor.dtype, tensor.numel()), [])
+            for i, (candidate, event) in enumerate(buffers):
+                # copies issued before release_pinned() may still be reading or writing the buffer
+                if event.query():
+                    buffer = candidate
+                    del buffers[i]
+                    break
+        if buffer is None:
+            # pin through Tensor.pin_memory() so that the torch_musa host allocator is used
+            buffer = torch.empty(tensor.numel(), dtype=tensor.dtype).pin_memory()
+            with _pinned_lock:
+                _record_buffer(_pinned_buffers, buffer)
+        pinned = buffer.view(tensor.shape)
+        pinned.copy_(tensor)
+        return pinned
+
+    # return a tensor obtained from pin_memory() to the pool so later pin_memory() calls can reuse it,
+    # the tensor must not be used afterwards. An event is recorded on stream (the current stream by default)
+    # and the buffer is only reused once it has completed, copies still pending on other streams must be
+    # synchronized by the caller first. Tensors not allocated by pin_memory() are left alone
+    def release_pinned(self, tensor, stream=None):
+        with _pinned_lock:
+            buffer = _whole_recorded_buffer(_pinned_buffers, tensor)
+            if buffer is None:
+                return
+            buffers = _pinned_pool[(buffer.dtype, buffer.numel())]
+            if len(buffers) >= _PINNED_POOL_MAX_BUFFERS:
+                return
+            if any(b.data_ptr() == buffer.data_ptr() for b, _ in buffers):
+                return
+            event = torch_musa.Event()
+            event.record(stream)
+            buffers.append((buffer, event))
 
     def on_accelerator(self, tensor):
-        device_str = str(tensor.device)
-        if device_str.startswith('musa:'):
-            return True
-        else:
-            return False
+        return tensor.device.type == 'musa'
 
     def op_builder_dir(self):
-        try:
-            # is op_builder from deepspeed or a 3p version? this should only succeed if it's deepspeed
-            # if successful this also means we're doing a local install and not JIT compile path
-            from op_builder import __deepspeed__  # noqa: F401
-            return "op_builder"
-        except ImportError:
-            return "deepspeed.ops.op_builder"
-
-    # dict that holds class name <--> class type mapping i.e.
-    # 'AsyncIOBuilder': <class 'op_builder.async_io.AsyncIOBuilder'>
-    # this dict will be filled at init stage
-    class_dict = None
-
-    def _lazy_init_class_dict(self):
-        if self.class_dict != None:
-            return
-        else:
-            self.class_dict = {}
-            # begin initialize for create_op_builder()
-            # put all valid class name <--> class type mapping into class_dict
-            op_builder_dir = self.op_builder_dir()
-            op_builder_module = importlib.import_module(op_builder_dir)
-            for _, module_name, _ in pkgutil.iter_modules([os.path.dirname(op_builder_module.__file__)]):
-                # avoid self references
-                if module_name != 'all_ops' and module_name != 'builder' and module_name != 'cpu':
-                    module = importlib.import_module("{}.{}".format(op_builder_dir, module_name))
-                    for member_name in module.__dir__():
-                        if member_name.endswith(
-                                'Builder'
-                        ) and member_name != "OpBuilder" and member_name != "CUDAOpBuilder" and member_name != "TorchCPUOpBuilder":  # avoid abstract classes
-                            if not member_name in self.class_dict:
-                                self.class_dict[member_name] = getattr(module, member_name)
-            # end initialize for create_op_builder()
+        return _resolve_op_builder_dir()
+
+    # static class name <--> (module name, class name) mapping of the op builders shipped with deepspeed,
+    # builder modules are only imported when one of their builders is requested
+    _BUILDER_MAP = {
+        'AsyncIOBuilder': ('async_io', 'AsyncIOBuilder'),
+        'CPUAdagradBuilder': ('cpu_adagrad', 'CPUAdagradBuilder'),
+        'CPUAdamBuilder': ('cpu_adam', 'CPUAdamBuilder'),
+        'FusedAdamBuilder': ('fused_adam', 'FusedAdamBuilder'),
+        'FusedLambBuilder': ('fused_lamb', 'FusedLambBuilder'),
+        'InferenceBuilder': ('transformer_inference', 'InferenceBuilder'),
+        'QuantizerBuilder': ('quantizer', 'QuantizerBuilder'),
+        'RandomLTDBuilder': ('random_ltd', 'RandomLTDBuilder'),
+        'SparseAttnBuilder': ('sparse_attn', 'SparseAttnBuilder'),
+        'SpatialInferenceBuilder': ('spatial_inference', 'SpatialInferenceBuilder'),
+        'StochasticTransformerBuilder': ('stochastic_transformer', 'StochasticTransformerBuilder'),
+        'TransformerBuilder': ('transformer', 'TransformerBuilder'),
+    }
 
     # create an instance of op builder and return, name specified by class_name
     def create_op_builder(self, class_name):
-        self._lazy_init_class_dict()
-        if class_name in self.class_dict:
-            return self.class_dict[class_name]()
+        builder_class = self.get_op_builder(class_name)
+        if builder_class is not None:
+            return builder_class()
         else:
             return None
 
     # return an op builder class, name specified by class_name
     def get_op_builder(self, class_name):
-        self._lazy_init_class_dict()
-        if class_name in self.class_dict:
-            return self.class_dict[class_name]
+        if class_name in self._BUILDER_MAP:
+            module_name, builder_name = self._BUILDER_MAP[class_name]
+            return getattr(importlib.import_module("{}.{}".format(self.op_builder_dir(), module_name)), builder_name)
         else:
             return None
 
     def build_extension(self):
         from torch.utils.cpp_extension import BuildExtension
         return BuildExtension
+
+
+# bind torch_musa objects onto MUSA_Accelerator, runs once when torch_musa is first imported
+def _bind_torch_musa():
+    # plain passthroughs are replaced by the torch_musa functions so hot calls skip the wrapper frame,
+    # the method definitions stay as the fallback when torch_musa lacks one of them
+    for name in MUSA_Accelerator._PASSTHROUGH_APIS:
+        func = getattr(torch_musa, name, None)
+        if func is not None:
+            setattr(MUSA_Accelerator, name, staticmethod(func))
+    for name in MUSA_Accelerator._TENSOR_TYPES:
+        setattr(MUSA_Accelerator, name, getattr(torch_musa, name, None))
+    nvtx = getattr(torch_musa, 'nvtx', None)
+    optional_apis = (('_memory_stats', getattr(torch_musa, 'memory_stats', None)),
+                     ('_reset_peak_memory_stats', getattr(torch_musa, 'reset_peak_memory_stats', None)),
+                     ('_memory_reserved', getattr(torch_musa, 'memory_reserved', None)),
+                     ('_max_memory_reserved', getattr(torch_musa, 'max_memory_reserved', None)),
+                     ('_range_push', getattr(nvtx, 'range_push', None)),
+                     ('_range_pop', getattr(nvtx, 'range_pop', None)),
+                     ('_mem_pool', getattr(torch_musa, 'MemPool', None)),
+                     ('_use_mem_pool', getattr(torch_musa, 'use_mem_pool', None)))
+    for name, func in optional_apis:
+        if func is not None:
+            setattr(MUSA_Accelerator, name, staticmethod(func))
+    MUSA_Accelerator._amp = getattr(torch_musa, 'amp', None)
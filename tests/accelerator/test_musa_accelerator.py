@@ -0,0 +1,161 @@
+# Copyright (c) Microsoft Corporation.
+# SPDX-License-Identifier: Apache-2.0
+
+# DeepSpeed Team
+
+import os
+import ast
+import pkgutil
+import importlib.util
+import pytest
+import torch
+from deepspeed.accelerator import get_accelerator
+from deepspeed.accelerator.musa_accelerator import MUSA_Accelerator
+
+# evaluated at collection time, hosts without torch_musa must still collect the device independent tests
+_musa_available = importlib.util.find_spec('torch_musa') is not None and get_accelerator().is_available()
+musa_available = pytest.mark.skipif(not _musa_available, reason="requires a MUSA device")
+
+
+@musa_available
+def test_pin_memory_reuses_released_buffer():
+    tensor = torch.randn(4, 8)
+    pinned = get_accelerator().pin_memory(tensor)
+    assert pinned.is_pinned()
+    assert torch.equal(pinned, tensor)
+    data_ptr = pinned.data_ptr()
+    get_accelerator().release_pinned(pinned)
+
+    # the pool is shared, so a later get_accelerator() call hands out the released buffer
+    other = torch.randn(8, 4)
+    reused = get_accelerator().pin_memory(other)
+    assert reused.data_ptr() == data_ptr
+    assert reused.shape == other.shape
+    assert torch.equal(reused, other)
+
+
+@musa_available
+def test_pin_memory_keeps_already_pinned_tensor():
+    tensor = torch.randn(16).pin_memory()
+    expected = tensor.clone()
+    assert get_accelerator().pin_memory(tensor) is tensor
+
+    # the caller's own pinned tensor must never be handed out by the pool
+    get_accelerator().release_pinned(tensor)
+    pinned = get_accelerator().pin_memory(torch.zeros(16))
+    assert pinned.data_ptr() != tensor.data_ptr()
+    assert torch.equal(tensor, expected)
+
+
+@musa_available
+def test_release_pinned_non_contiguous():
+    pinned = get_accelerator().pin_memory(torch.randn(4, 8))
+    data_ptr = pinned.data_ptr()
+    # a partial view is not the whole buffer and is ignored, a transposed view releases the buffer
+    get_accelerator().release_pinned(pinned[:, :2])
+    get_accelerator().release_pinned(pinned.t())
+    assert get_accelerator().pin_memory(torch.randn(32)).data_ptr() == data_ptr
+
+
+
+@musa_available
+def test_release_pinned_inference_mode():
+    # views created under inference mode do not keep their base alive, ownership must still be recognized
+    with torch.inference_mode():
+        pinned = get_accelerator().pin_memory(torch.randn(4, 8))
+        data_ptr = pinned.data_ptr()
+        get_accelerator().release_pinned(pinned)
+        del pinned
+        assert get_accelerator().pin_memory(torch.randn(32)).data_ptr() == data_ptr
+
+
+@musa_available
+def test_release_pinned_waits_for_stream():
+    stream = get_accelerator().Stream()
+    pinned = get_accelerator().pin_memory(torch.randn(1024, 1024))
+    data_ptr = pinned.data_ptr()
+    with get_accelerator().stream(stream):
+        device_tensor = pinned.to(get_accelerator().device_name(), non_blocking=True)
+        get_accelerator().release_pinned(pinned, stream)
+    stream.synchronize()
+    # the event recorded on stream has completed, so the buffer can be handed out again
+    assert get_accelerator().pin_memory(torch.randn(1024, 1024)).data_ptr() == data_ptr
+    assert device_tensor.shape == (1024, 1024)
+
+
+@musa_available
+@pytest.mark.parametrize('dtype', [torch.uint8, torch.half, torch.float, torch.double])
+def test_alloc_workspace_rounding(dtype):
+    element_size = torch.tensor([], dtype=dtype).element_size()
+    workspace = get_accelerator().alloc_workspace(100, dtype)
+    assert workspace.dtype == dtype
+    assert workspace.dim() == 1
+    assert workspace.numel() * element_size == 512
+    assert get_accelerator().on_accelerator(workspace)
+    get_accelerator().free_workspace(workspace)
+
+
+@musa_available
+def test_alloc_workspace_reuses_freed_buffer():
+    workspace = get_accelerator().alloc_workspace(1000, torch.float)
+    data_ptr = workspace.data_ptr()
+    get_accelerator().free_workspace(workspace)
+
+    # same rounded size and dtype reuse the buffer, a different dtype does not
+    assert get_accelerator().alloc_workspace(1024, torch.half).data_ptr() != data_ptr
+    reused = get_accelerator().alloc_workspace(1024, torch.float)
+    assert reused.data_ptr() == data_ptr
+    assert reused.numel() == 256
+
+
+
+@musa_available
+def test_free_workspace_ignores_slices_and_foreign_tensors():
+    workspace = get_accelerator().alloc_workspace(4096, torch.float)
+    # a slice aliases the live workspace and a caller's own tensor is not owned by the cache, neither is pooled
+    get_accelerator().free_workspace(workspace[:640])
+    get_accelerator().free_workspace(torch.empty(640, dtype=torch.float, device=get_accelerator().device_name()))
+    reused = get_accelerator().alloc_workspace(2560, torch.float)
+    assert reused.data_ptr() != workspace.data_ptr()
+    assert reused.untyped_storage().nbytes() == 2560
+
+    # freeing the same buffer twice pools it once
+    get_accelerator().free_workspace(reused)
+    get_accelerator().free_workspace(reused)
+    assert get_accelerator().alloc_workspace(2560, torch.float).data_ptr() == reused.data_ptr()
+    assert get_accelerator().alloc_workspace(2560, torch.float).data_ptr() != reused.data_ptr()
+
+
+@musa_available
+@pytest.mark.skipif(not _musa_available or get_accelerator().device_count() < 2,
+                    reason="requires two MUSA devices")
+def test_alloc_workspace_per_device():
+    current = get_accelerator().current_device()
+    try:
+        get_accelerator().set_device(0)
+        get_accelerator().free_workspace(get_accelerator().alloc_workspace(512, torch.float))
+        get_accelerator().set_device(1)
+        workspace = get_accelerator().alloc_workspace(512, torch.float)
+        assert workspace.device.index == 1
+    finally:
+        get_accelerator().set_device(current)
+
+
+def test_builder_map_matches_op_builder():
+    # collect the *Builder classes defined in op_builder, with the exclusions of the former dynamic scan
+    op_builder_module = importlib.import_module(MUSA_Accelerator().op_builder_dir())
+    op_builder_path = os.path.dirname(op_builder_module.__file__)
+    builders = {}
+    for _, module_name, is_pkg in pkgutil.iter_modules([op_builder_path]):
+        if module_name in ('all_ops', 'builder', 'cpu') or is_pkg:
+            continue
+        with open(os.path.join(op_builder_path, module_name + '.py')) as f:
+            module_ast = ast.parse(f.read())
+        for node in module_ast.body:
+            if isinstance(node, ast.ClassDef) and node.name.endswith('Builder') and node.name not in (
+                    'OpBuilder', 'CUDAOpBuilder', 'TorchCPUOpBuilder'):
+                builders[node.name] = (module_name, node.name)
+
+    assert MUSA_Accelerator._BUILDER_MAP == builders
+    for class_name in builders:
+        assert MUSA_Accelerator().get_op_builder(class_name).__name__ == class_name